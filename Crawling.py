@@ -14,6 +14,8 @@ import time
 import random
 #导入处理和保存数据的工具库
 from output import output
+#导入性能分析工具（默认关闭）
+from profiler import profiler, profiled
 
 # 网站配置
 WEBSITE_CONFIGS = {
@@ -176,8 +178,34 @@ def merge_configs(website_name, website_config):
 
 
 
+# 性能分析（使用 --profile 参数或设置环境变量 CRAWL_PROFILE=1 开启）
+def setup_profiling():
+    """按配置开启性能分析"""
+    try:
+        import config_secret
+        profile_config = config_secret.get_profile_config()
+    except (ImportError, AttributeError):
+        profile_config = {}
+
+    profiler.configure(
+        enabled=True,
+        output_folder=profile_config.get("output_folder"),
+        trace_memory=profile_config.get("trace_memory", False),
+        top_n=profile_config.get("top_n", 10)
+    )
+
+
+def report_profiling():
+    """保存分析报告并显示热点"""
+    if not profiler.enabled:
+        return
+    saved_files = profiler.save_reports()
+    output.show_profile_summary(profiler.get_hotspots(), saved_files)
+
+
 # 第五步 集成全部代码（类似RPA流程自动化，将每个环节的代码调用起来）
 # 主程序
+@profiled('main')
 def main():
     """主函数"""
 
@@ -253,7 +281,21 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        if "--profile" in sys.argv or os.environ.get("CRAWL_PROFILE"):
+            setup_profiling()
+
+        if "--watch" in sys.argv:
+            # 监听模式：data 目录中新增/修改的文件写入完成后立即入库
+            import watcher
+            watcher.run_watch()
+        elif "--export" in sys.argv:
+            # 导出模式：按村打包导出数据库中各数据集最新的数据（--force 忽略导出清单）
+            import data_exporter
+            data_exporter.run_export(force="--force" in sys.argv)
+        else:
+            main()
+
+        report_profiling()
     except KeyboardInterrupt:
         print("\n\n⏹️  程序被用户中断")
     except Exception as e:
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cleaning_rules.py - 报表类型清洗规则
+清洗规则按报表类型（如“收支情况公布表”）在配置中声明，
+每个进程只编译一次为向量化的清洗计划，之后同类报表直接复用
+"""
+
+import re
+import json
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+
+# 报表目录名形如“9 收支情况公布表”
+_REPORT_FOLDER_PATTERN = re.compile(r'^\d+\s*(.+)$')
+
+# 报表文件名形如“A村经济联合社2025年收支情况公布表”，年份之前为报表单位
+_UNIT_FILE_PATTERN = re.compile(r'^(.+?)\d{4}年')
+
+# 已编译的清洗计划（按规则内容缓存，进程内只编译一次）
+_COMPILED_PLANS = {}
+
+
+def report_type_from_path(path: Optional[str]) -> Optional[str]:
+    """根据文件所在目录名识别报表类型"""
+    if not path:
+        return None
+    match = _REPORT_FOLDER_PATTERN.match(Path(path).parent.name)
+    return match.group(1).strip() if match else None
+
+
+def dataset_from_path(path: Optional[str]) -> Optional[str]:
+    """
+    数据集标识：<来源>/<NN 表名>/<文件名>（与监听模式的相对路径一致）
+
+    同一来源文件的各次采集互为新旧版本；不在报表目录中的文件返回 None
+    """
+    if not path or report_type_from_path(path) is None:
+        return None
+    return Path(*Path(path).parts[-3:]).as_posix()
+
+
+def unit_from_path(path: Optional[str]) -> Optional[str]:
+    """根据文件名识别报表单位（如“A村经济联合社”）"""
+    if not path:
+        return None
+    match = _UNIT_FILE_PATTERN.match(Path(path).stem)
+    return match.group(1).strip() if match else None
+
+
+class CleaningPlan:
+    """单个报表类型的清洗计划（按固定顺序执行的向量化步骤）"""
+
+    def __init__(self, report_type: str, rule: Dict[str, Any]):
+        """
+        编译清洗规则
+
+        Args:
+            report_type: 报表类型
+            rule: 声明式规则，支持的键：
+                header_row: 表头所在行（相对解析结果），该行提升为列名
+                extract_cells: {新列名: {row, column, pattern}} 从表头前的单元格提取常量列
+                drop_rows_matching: {column, pattern} 删除首列等匹配的行（如签名行）
+                drop_empty_rows: 删除全空行
+                rename: 列重命名
+                text_columns: 保持为文本的列（如带前导零的编号）
+                numeric_columns: 转换为数值的列
+                money_columns: 金额列（转换为数值，空值填0，按分存储）
+                ffill_columns: 向下填充的列（合并单元格）
+                required_columns: 为空则删除该行的列
+                drop_duplicates: 删除重复行
+                key_columns: 行键列（变更捕获据此区分修改与删除+新增）
+        """
+        self.report_type = report_type
+        self.header_row = rule.get('header_row')
+        self.extract_cells = [
+            (name, spec['row'], spec['column'], re.compile(spec['pattern']) if spec.get('pattern') else None)
+            for name, spec in rule.get('extract_cells', {}).items()
+        ]
+        drop_rule = rule.get('drop_rows_matching')
+        self.drop_rows = (drop_rule.get('column', 0), re.compile(drop_rule['pattern'])) \
+            if drop_rule else None
+        self.rename = dict(rule.get('rename', {}))
+        self.text_columns = list(rule.get('text_columns', []))
+        self.numeric_columns = list(rule.get('numeric_columns', []))
+        self.money_columns = list(rule.get('money_columns', []))
+        self.ffill_columns = list(rule.get('ffill_columns', []))
+        self.required_columns = list(rule.get('required_columns', []))
+        self.key_columns = list(rule.get('key_columns', []))
+
+        # 按执行顺序组装步骤
+        self.steps = []
+        if self.header_row is not None:
+            self.steps.append(self._promote_header)
+        if self.drop_rows:
+            self.steps.append(self._drop_matching_rows)
+        if rule.get('drop_empty_rows', True):
+            self.steps.append(lambda df: df.dropna(how='all'))
+        if self.rename:
+            self.steps.append(lambda df: df.rename(columns=self.rename))
+        if self.text_columns:
+            self.steps.append(self._to_text)
+        if self.numeric_columns:
+            self.steps.append(self._to_numeric)
+        if self.money_columns:
+            self.steps.append(self._to_money)
+        if self.ffill_columns:
+            self.steps.append(self._ffill)
+        if self.required_columns:
+            self.steps.append(self._drop_missing_required)
+        if rule.get('drop_duplicates', False):
+            self.steps.append(lambda df: df.drop_duplicates())
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """执行清洗计划"""
+        extracted = self._extract(df)
+        for step in self.steps:
+            df = step(df)
+        for name, value in extracted.items():
+            df[name] = value
+        return df
+
+    def _extract(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """从指定单元格提取常量（如报表单位）"""
+        extracted = {}
+        for name, row, column, pattern in self.extract_cells:
+            if row >= len(df) or column >= len(df.columns):
+                continue
+            value = df.iat[row, column]
+            if pd.isna(value):
+                continue
+            value = str(value).strip()
+            if pattern is not None:
+                match = pattern.search(value)
+                if not match:
+                    continue
+                value = match.group(1) if match.groups() else match.group(0)
+            extracted[name] = value
+        return extracted
+
+    def _promote_header(self, df: pd.DataFrame) -> pd.DataFrame:
+        """将 header_row 行提升为列名（重复列名按 pandas 习惯追加 .1/.2）"""
+        if self.header_row >= len(df):
+            return df
+        names, seen = [], {}
+        for index, value in enumerate(df.iloc[self.header_row]):
+            name = str(value).strip() if pd.notna(value) else f'Unnamed: {index}'
+            if name in seen:
+                seen[name] += 1
+                name = f'{name}.{seen[name]}'
+            else:
+                seen[name] = 0
+            names.append(name)
+        df = df.iloc[self.header_row + 1:].copy()
+        df.columns = names
+        return df.reset_index(drop=True)
+
+    def _drop_matching_rows(self, df: pd.DataFrame) -> pd.DataFrame:
+        """删除指定列匹配正则的行"""
+        column, pattern = self.drop_rows
+        if column >= len(df.columns):
+            return df
+        first = df.iloc[:, column]
+        mask = first.astype(str).str.contains(pattern, regex=True, na=False) & first.notna()
+        return df[~mask]
+
+    def _present(self, df: pd.DataFrame, columns: List[str]) -> List[str]:
+        """规则中在当前数据里存在的列"""
+        return [col for col in columns if col in df.columns]
+
+    def _to_text(self, df: pd.DataFrame) -> pd.DataFrame:
+        for col in self._present(df, self.text_columns):
+            df[col] = df[col].astype(object).where(df[col].isna(), df[col].astype(str))
+        return df
+
+    def _to_numeric(self, df: pd.DataFrame) -> pd.DataFrame:
+        for col in self._present(df, self.numeric_columns):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+    def _to_money(self, df: pd.DataFrame) -> pd.DataFrame:
+        for col in self._present(df, self.money_columns):
+            series = df[col]
+            if not pd.api.types.is_numeric_dtype(series):
+                series = series.astype(str).str.replace(',', '', regex=False)
+            df[col] = pd.to_numeric(series, errors='coerce').fillna(0)
+        return df
+
+    def _ffill(self, df: pd.DataFrame) -> pd.DataFrame:
+        columns = self._present(df, self.ffill_columns)
+        if columns:
+            df[columns] = df[columns].ffill()
+        return df
+
+    def _drop_missing_required(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df.dropna(subset=self._present(df, self.required_columns))
+
+
+def compile_rules(rules: Dict[str, Dict[str, Any]]) -> Dict[str, CleaningPlan]:
+    """
+    编译全部报表类型的清洗规则（相同规则在进程内只编译一次）
+
+    Args:
+        rules: {报表类型: 规则}
+
+    Returns:
+        {报表类型: CleaningPlan}
+    """
+    cache_key = json.dumps(rules, ensure_ascii=False, sort_keys=True)
+    plans = _COMPILED_PLANS.get(cache_key)
+    if plans is None:
+        plans = {report_type: CleaningPlan(report_type, rule)
+                 for report_type, rule in rules.items()}
+        _COMPILED_PLANS[cache_key] = plans
+    return plans
@@ -71,22 +71,162 @@ def get_sensitive_config():
         "retry_count": 3
     }
     
+    # 导出配置（导出目录不能放在 data 下，否则会被监听模式当作新数据入库）
+    # group_by: unit 每村一个文件包 / report_type 每个报表类型一个文件包 / table 每张数据表一个文件包
+    export_config = {
+        "export_folder": str(project_root / "exports"),
+        "group_by": "unit",
+        "formats": ["xlsx"],
+        "export_chunksize": 5000,
+        "export_workers": 4
+    }
+    
+    # 流水线配置（各阶段并行度与输入队列容量）
+    pipeline_config = {
+        "fetch": {"workers": 4, "queue_size": 16},
+        "parse": {"workers": 2, "queue_size": 4, "processes": 2},
+        "clean": {"workers": 2, "queue_size": 4},
+        "write": {"workers": 1, "queue_size": 4}
+    }
+    
+    # 监听配置（data 下的来源目录与网站名称的对应关系；同时就绪的多个文件按流水线配置批量入库）
+    watch_config = {
+        "data_root": str(project_root / "data"),
+        "source_websites": {
+            "acctedu": "三资财务管理平台",
+            "chinatax": "广西税务局",
+            "dnr": "广西自然资源厅",
+            "gxzf": "广西政府网",
+            "tjj": "广西统计局"
+        },
+        "debounce_seconds": 2.0,
+        "poll_interval": 1.0,
+        "watch_backend": "auto"
+    }
+    
+    # 性能分析配置（使用 --profile 参数或设置环境变量 CRAWL_PROFILE=1 开启）
+    # trace_memory 开启后程序整体会慢数倍，只在排查内存问题时打开
+    profile_config = {
+        "output_folder": str(project_root / "data" / "profiles"),
+        "trace_memory": False,
+        "top_n": 10
+    }
+    
     # 将所有配置合并
     full_config = {
         "sensitive": sensitive_config,
         "database": database_config,
-        "network": network_config
+        "network": network_config,
+        "export": export_config,
+        "pipeline": pipeline_config,
+        "watch": watch_config,
+        "profile": profile_config
     }
     
     return full_config
 
 
+def get_cleaning_rules():
+    """
+    获取按报表类型声明的清洗规则
+
+    新增县区或报表时只需在此声明规则，无需修改清洗代码
+    """
+    # 各报表通用结构：第1行为报表单位，第4行为表头，表尾为签名行
+    common_rule = {
+        "header_row": 3,
+        "extract_cells": {
+            "报表单位": {"row": 0, "column": 0, "pattern": r"^(?:报表)?(?:单位[：:])?\s*(.+)$"}
+        },
+        "drop_rows_matching": {"column": 0, "pattern": r"^(?:单位负责人|会计|出纳|制表|财务公开监督)"},
+        "drop_empty_rows": True
+    }
+    # key_columns 为行键列：同一报表两次采集间键相同、内容不同的行记为修改
+    asset_rule = dict(common_rule, text_columns=["资产编号"], numeric_columns=["资产面积"],
+                      required_columns=["资产名称"], key_columns=["资产编号"])
+    ledger_keys = ["日期", "摘要"]
+    
+    cleaning_rules = {
+        "经营性资产公布表": asset_rule,
+        "非经营性资产公布表": asset_rule,
+        "闲置经营性资产公布表": dict(asset_rule, text_columns=["资产编号", "原合同号"]),
+        "合同执行情况公布表": dict(common_rule, text_columns=["合同编号", "资产编号"],
+                                   money_columns=["应收未收金额(含截至当前月度本年应收金额及以前年度应收未收金额)",
+                                                  "本年已收金额", "累计未收金额"],
+                                   key_columns=["合同编号"]),
+        "小额工程项目公布表": dict(common_rule, text_columns=["项目编号"],
+                                   money_columns=["合同金额", "合同结算情况|本期支付金额",
+                                                  "合同结算情况|待付金额", "合同结算情况|累计支付金额"],
+                                   key_columns=["项目编号"]),
+        "现金收支明细公布表": dict(common_rule, money_columns=["收入金额", "支出金额", "余额"],
+                                   key_columns=ledger_keys),
+        "银行存款收支明细公布表": dict(common_rule, money_columns=["收入金额", "支出金额", "余额"],
+                                       key_columns=ledger_keys),
+        "收支情况公布表": dict(common_rule, money_columns=["本月数", "累计数", "本月数.1", "累计数.1"],
+                               key_columns=["收入项目", "支出项目"]),
+        "集体土地征占补偿及支出公布表": dict(common_rule,
+                                             money_columns=["上期余额", "本期收入", "本期支出", "结余"],
+                                             key_columns=["项目"]),
+        "政府拨款监管台账": dict(common_rule, money_columns=["上期余额", "本期收入", "本期支出", "结余"],
+                                 key_columns=["项目名称"]),
+        # 行次多为空，按左右两栏的项目名称区分
+        "资产负债表": dict(common_rule, numeric_columns=["行次", "行次.1"],
+                           money_columns=["期末数", "年初数", "期末数.1", "年初数.1"],
+                           key_columns=["资产", "负债及所有者权益"]),
+        "收益分配表": dict(common_rule, numeric_columns=["行次"], money_columns=["本月数", "本年数"],
+                           key_columns=["项目"]),
+        "民主程序表决情况公布表": dict(common_rule, drop_duplicates=True, key_columns=["序号"]),
+        # 每个单位每期只有一行
+        "民主监督机构理财结果公布表": dict(
+            common_rule,
+            numeric_columns=["本月现金收入（笔）", "本月银行存款收入（笔）",
+                             "本月现金支出（笔）", "本月银行存款支出（笔）"],
+            money_columns=["现金帐面余额", "实地清点现金", "长（短）款", "库存现金", "超出规定限额",
+                           "库存现金“白条抵库”金额", "借方差异", "贷方差异", "余额差异",
+                           "本月现金收入（元）", "本月银行存款收入（元）",
+                           "本月现金支出（元）", "本月银行存款支出（元）", "银行存款帐面余额"],
+            key_columns=["报表单位"]
+        )
+    }
+    
+    return cleaning_rules
+
+
 def get_database_config():
     """获取数据库配置"""
     config = get_sensitive_config()
     return config.get("database", {})
 
 
+def get_export_config():
+    """获取导出配置（包含数据库路径）"""
+    config = get_sensitive_config()
+    export_config = dict(config.get("export", {}))
+    export_config["database_path"] = config.get("database", {}).get("database_path")
+    return export_config
+
+
+def get_pipeline_config():
+    """获取流水线阶段配置"""
+    config = get_sensitive_config()
+    return config.get("pipeline", {})
+
+
+def get_watch_config():
+    """获取监听配置（包含数据库路径）"""
+    config = get_sensitive_config()
+    watch_config = dict(config.get("watch", {}))
+    watch_config["database_path"] = config.get("database", {}).get("database_path")
+    watch_config["pipeline"] = config.get("pipeline", {})
+    return watch_config
+
+
+def get_profile_config():
+    """获取性能分析配置"""
+    config = get_sensitive_config()
+    return config.get("profile", {})
+
+
 def get_website_sensitive_config(website_name):
     """获取指定网站的敏感配置"""
     config = get_sensitive_config()
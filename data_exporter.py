@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+data_exporter.py - 数据导出模块
+将数据库中清洗后的数据按村/报表分块导出为 Excel/CSV/Parquet 文件包
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+from cleaning_rules import report_type_from_path
+from data_processor import iter_table_chunks, create_storage_tables
+
+
+SUPPORTED_FORMATS = ('xlsx', 'csv', 'parquet')
+GROUP_BY_OPTIONS = ('unit', 'report_type', 'table')
+
+
+class DataExporter:
+    """流式数据导出器（分块读取、常量内存写出）"""
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        初始化导出器
+
+        Args:
+            config: 配置字典
+        """
+        self.config = config
+        self.db_path = config.get('database_path', 'crawled_data.db')
+        self.export_folder = Path(config.get('export_folder', 'exports'))
+        self.chunksize = config.get('export_chunksize', 5000)
+        self.max_workers = config.get('export_workers', 4)
+
+        self.conn = sqlite3.connect(self.db_path)
+        self._init_manifest()
+
+        # 导出统计
+        self.stats = {
+            'targets_exported': 0,
+            'targets_skipped': 0,
+            'targets_failed': 0,
+            'rows_exported': 0,
+            'export_time': 0
+        }
+
+    def _init_manifest(self):
+        """初始化导出清单表（用于跳过未变化的导出目标）"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_manifest (
+                target_name TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                output_path TEXT,
+                row_count INTEGER,
+                exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # 旧版本数据库没有存储信息表，补建为空表（所有数据表按原样导出）
+        create_storage_tables(cursor)
+        self.conn.commit()
+
+    def build_targets(self, group_by: str = 'table', group_column: Optional[str] = None,
+                      formats: List[str] = ('xlsx',),
+                      website_name: Optional[str] = None,
+                      latest_only: bool = True) -> List[Dict[str, Any]]:
+        """
+        生成导出目标
+
+        Args:
+            group_by: 分包方式：unit 每村（报表单位）一个文件包，工作表按报表类型命名；
+                      report_type 每个报表类型一个文件包，工作表按村命名；
+                      table 每张数据表一个文件包。
+                      无法识别村/报表类型的数据表各自单独成包
+            group_column: 按数据列的取值分包（如“报表单位”），设置后忽略 group_by
+            formats: 导出格式列表（xlsx/csv/parquet）
+            website_name: 仅导出指定网站的数据
+            latest_only: 每个数据集（同一来源文件）仅导出最新一次采集的数据表
+
+        Returns:
+            导出目标列表
+        """
+        if group_by not in GROUP_BY_OPTIONS:
+            raise ValueError(f"不支持的分包方式: {group_by}")
+        sources = self._source_tables(website_name, latest_only)
+
+        # 各文件包的数据表 {文件包名: [(工作表名, 数据表名)]}，保持首次出现的顺序
+        packages = {}
+        wheres = {}
+        for source in sources:
+            if group_column:
+                entry = (_table_label(source, 'report_type'), source['table_name'])
+                for value in self._distinct_values(source['table_name'], group_column):
+                    packages.setdefault(value, []).append(entry)
+                    wheres[value] = {group_column: value}
+            elif group_by == 'unit' and source['unit']:
+                packages.setdefault(source['unit'], []).append(
+                    (_table_label(source, 'report_type'), source['table_name']))
+            elif group_by == 'report_type' and source['report_type']:
+                packages.setdefault(source['report_type'], []).append(
+                    (_table_label(source, 'unit'), source['table_name']))
+            else:
+                packages[source['table_name']] = [
+                    (_table_label(source, 'report_type'), source['table_name'])]
+
+        targets = []
+        for fmt in formats:
+            if fmt not in SUPPORTED_FORMATS:
+                print(f"   ⚠️  不支持的导出格式: {fmt}")
+                continue
+            for package, tables in packages.items():
+                targets.append(self._make_target(package, tables, wheres.get(package), fmt))
+
+        return targets
+
+    def _source_tables(self, website_name: Optional[str], latest_only: bool) -> List[Dict[str, Any]]:
+        """
+        列出待导出的数据表及其来源信息（crawl_sources，入库时记录）
+
+        同一网站的每个工作簿都保存在该网站名下，因此“最新”按来源文件判断；
+        未记录来源文件（或数据集不是来源文件路径）的数据表各自独立，全部导出
+        """
+        query = ('SELECT m.website_name, m.table_name, s.dataset, s.report_type, s.unit '
+                 'FROM crawl_metadata m LEFT JOIN crawl_sources s ON s.table_name = m.table_name')
+        params = []
+        if website_name:
+            query += ' WHERE m.website_name = ?'
+            params.append(website_name)
+        query += ' ORDER BY m.id'
+
+        sources = {}
+        for site, table_name, dataset, report_type, unit in self.conn.execute(query, params):
+            key = table_name
+            if latest_only and report_type_from_path(dataset) is not None:
+                # 按 id 顺序覆盖，保留来源文件最新的数据表（保持首次出现的顺序）
+                key = dataset
+            sources[key] = {
+                'site': site,
+                'table_name': table_name,
+                'dataset': dataset,
+                'report_type': report_type,
+                'unit': unit
+            }
+        return list(sources.values())
+
+    def _make_target(self, package: str, tables: List, where: Optional[Dict[str, Any]],
+                     fmt: str) -> Dict[str, Any]:
+        """组装单个导出目标"""
+        package_name = _safe_name(package)
+        if fmt == 'xlsx':
+            path = self.export_folder / f"{package_name}.xlsx"
+        else:
+            path = self.export_folder / package_name
+        return {
+            'name': f"{package_name}.{fmt}",
+            'tables': tables,
+            'where': where,
+            'format': fmt,
+            'path': str(path)
+        }
+
+    def _distinct_values(self, table_name: str, column: str) -> List[str]:
+        """获取数据表中某列的全部取值（表中无该列时返回空列表）"""
+        columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table_name}")')]
+        if column not in columns:
+            return []
+
+        values = [row[0] for row in self.conn.execute(
+            'SELECT value FROM category_values WHERE table_name = ? AND column_name = ?',
+            (table_name, column))]
+        if values:
+            return values
+        return [str(row[0]) for row in self.conn.execute(
+            f'SELECT DISTINCT "{column}" FROM "{table_name}" WHERE "{column}" IS NOT NULL')]
+
+    def _fingerprint(self, target: Dict[str, Any]) -> str:
+        """
+        计算导出目标的源数据指纹
+
+        每次采集都会生成新的数据表，因此源表名与行数不变即可认为源数据未变化
+        """
+        table_names = [table_name for _, table_name in target['tables']]
+        placeholders = ','.join('?' * len(table_names))
+        rows = self.conn.execute(
+            f'SELECT table_name, row_count, crawl_timestamp FROM crawl_metadata '
+            f'WHERE table_name IN ({placeholders}) ORDER BY table_name', table_names
+        ).fetchall()
+        payload = json.dumps({
+            'tables': target['tables'],
+            'where': target['where'],
+            'format': target['format'],
+            'sources': rows
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def _is_unchanged(self, target: Dict[str, Any], fingerprint: str) -> bool:
+        """判断导出目标是否可以跳过"""
+        row = self.conn.execute(
+            'SELECT fingerprint, output_path FROM export_manifest WHERE target_name = ?',
+            (target['name'],)).fetchone()
+        return bool(row) and row[0] == fingerprint and os.path.exists(row[1])
+
+    def export(self, targets: List[Dict[str, Any]], force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        并行导出全部目标
+
+        Args:
+            targets: build_targets 生成的导出目标
+            force: 忽略导出清单，全部重新导出
+
+        Returns:
+            {目标名: {'status': ..., 'rows': ..., 'path': ...}}
+        """
+        start_time = time.time()
+        self.export_folder.mkdir(parents=True, exist_ok=True)
+
+        results = {}
+        pending = {}
+        for target in targets:
+            fingerprint = self._fingerprint(target)
+            if not force and self._is_unchanged(target, fingerprint):
+                results[target['name']] = {'status': 'skipped', 'rows': 0, 'path': target['path']}
+                self.stats['targets_skipped'] += 1
+            else:
+                pending[target['name']] = (target, fingerprint)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._export_target, target): name
+                for name, (target, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                target, fingerprint = pending[name]
+                try:
+                    row_count = future.result()
+                except Exception as e:
+                    print(f"   ❌ 导出失败 {name}: {str(e)[:50]}")
+                    results[name] = {'status': 'failed', 'rows': 0, 'path': target['path']}
+                    self.stats['targets_failed'] += 1
+                    continue
+
+                # 导出清单仅在主线程中更新
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO export_manifest
+                    (target_name, fingerprint, output_path, row_count, exported_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (name, fingerprint, target['path'], row_count))
+                self.conn.commit()
+
+                results[name] = {'status': 'exported', 'rows': row_count, 'path': target['path']}
+                self.stats['targets_exported'] += 1
+                self.stats['rows_exported'] += row_count
+
+        self.stats['export_time'] += time.time() - start_time
+        return results
+
+    def _export_target(self, target: Dict[str, Any]) -> int:
+        """
+        导出单个目标（在工作线程中执行，使用独立的数据库连接）
+
+        Returns:
+            导出行数
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            writer = {
+                'xlsx': self._write_xlsx,
+                'csv': self._write_csv,
+                'parquet': self._write_parquet
+            }[target['format']]
+            return writer(conn, target)
+        finally:
+            conn.close()
+
+    def _iter_chunks(self, conn: sqlite3.Connection, table_name: str,
+                     where: Optional[Dict[str, Any]]):
+        """分块读取源数据，金额列由分还原为元"""
+        cents_cols = [row[0] for row in conn.execute(
+            "SELECT column_name FROM column_schema WHERE table_name = ? "
+            "AND storage_type = 'cents'", (table_name,))]
+        for chunk in iter_table_chunks(conn, table_name, self.chunksize, where):
+            for col in cents_cols:
+                if col in chunk.columns:
+                    chunk[col] = chunk[col].astype('Float64') / 100
+            yield chunk
+
+    def _write_xlsx(self, conn: sqlite3.Connection, target: Dict[str, Any]) -> int:
+        """写出xlsx（只写模式，每张源表一个工作表）"""
+        from openpyxl import Workbook
+
+        path = Path(target['path'])
+        tmp_path = path.with_name(path.name + '.tmp')
+        workbook = Workbook(write_only=True)
+        sheet_names = set()
+        row_count = 0
+
+        for label, table_name in target['tables']:
+            sheet = None
+            for chunk in self._iter_chunks(conn, table_name, target['where']):
+                if sheet is None:
+                    sheet = workbook.create_sheet(_sheet_title(label, sheet_names))
+                    sheet.append([str(col) for col in chunk.columns])
+                for row in chunk.astype(object).itertuples(index=False, name=None):
+                    sheet.append([None if pd.isna(value) else value for value in row])
+                row_count += len(chunk)
+
+        if not workbook.worksheets:
+            workbook.create_sheet('空')
+        workbook.save(tmp_path)
+        os.replace(tmp_path, path)
+        return row_count
+
+    def _write_csv(self, conn: sqlite3.Connection, target: Dict[str, Any]) -> int:
+        """写出CSV（文件包目录下每张源表一个文件，分块追加）"""
+        package_dir = Path(target['path'])
+        package_dir.mkdir(parents=True, exist_ok=True)
+        row_count = 0
+
+        file_names = set()
+        for label, table_name in target['tables']:
+            path = package_dir / f"{_unique_name(_safe_name(label), file_names)}.csv"
+            tmp_path = path.with_name(path.name + '.tmp')
+            first = True
+            for chunk in self._iter_chunks(conn, table_name, target['where']):
+                chunk.to_csv(tmp_path, mode='w' if first else 'a', header=first,
+                             index=False, encoding='utf-8-sig' if first else 'utf-8')
+                first = False
+                row_count += len(chunk)
+            if not first:
+                os.replace(tmp_path, path)
+
+        return row_count
+
+    def _write_parquet(self, conn: sqlite3.Connection, target: Dict[str, Any]) -> int:
+        """写出Parquet（需要 pyarrow，分块写入 row group）"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet导出需要安装 pyarrow")
+
+        package_dir = Path(target['path'])
+        package_dir.mkdir(parents=True, exist_ok=True)
+        row_count = 0
+
+        file_names = set()
+        for label, table_name in target['tables']:
+            path = package_dir / f"{_unique_name(_safe_name(label), file_names)}.parquet"
+            tmp_path = path.with_name(path.name + '.tmp')
+            writer = None
+            try:
+                for chunk in self._iter_chunks(conn, table_name, target['where']):
+                    # 各分块的分类字典不同，统一按字符串写出
+                    for col in chunk.select_dtypes(include=['category']).columns:
+                        chunk[col] = chunk[col].astype(object)
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    else:
+                        table = table.cast(writer.schema)
+                    writer.write_table(table)
+                    row_count += len(chunk)
+            finally:
+                if writer is not None:
+                    writer.close()
+            if writer is not None:
+                os.replace(tmp_path, path)
+
+        return row_count
+
+    def get_export_stats(self) -> Dict[str, Any]:
+        """获取导出统计"""
+        return self.stats.copy()
+
+    def close(self):
+        """关闭数据库连接"""
+        if hasattr(self, 'conn'):
+            self.conn.close()
+
+
+def _safe_name(name: Any) -> str:
+    """生成可用作文件名的字符串"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', str(name)).strip('_') or '未命名'
+
+
+def _unique_name(base: str, used: set) -> str:
+    """在同一文件包内生成不重复的名称（重名时追加序号）"""
+    name, index = base, 1
+    while name in used:
+        index += 1
+        name = f"{base}_{index}"
+    used.add(name)
+    return name
+
+
+def _sheet_title(name: str, used: set) -> str:
+    """生成不重复的工作表名（Excel限制31个字符）"""
+    return _unique_name(re.sub(r'[\[\]:*?/\\]', '_', str(name))[:28] or 'Sheet', used)
+
+
+def _table_label(source: Dict[str, Any], field: str) -> str:
+    """数据表在文件包内的名称：优先取来源信息字段，其次来源文件名，最后数据表名"""
+    if source.get(field):
+        return source[field]
+    if source.get('dataset'):
+        return Path(source['dataset']).stem
+    return source['table_name']
+
+
+def export_database(config: Dict[str, Any], group_by: str = 'unit',
+                    group_column: Optional[str] = None, formats: List[str] = ('xlsx',),
+                    force: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    导出数据库（简化接口）
+    """
+    exporter = DataExporter(config)
+    try:
+        targets = exporter.build_targets(group_by=group_by, group_column=group_column,
+                                         formats=formats)
+        return exporter.export(targets, force=force)
+    finally:
+        exporter.close()
+
+
+def run_export(config: Optional[Dict[str, Any]] = None, force: bool = False):
+    """
+    按配置导出数据库（python Crawling.py --export）
+    """
+    if config is None:
+        import config_secret
+        config = config_secret.get_export_config()
+
+    print(f"📦 开始导出数据: {config.get('export_folder', 'exports')}")
+    exporter = DataExporter(config)
+    try:
+        targets = exporter.build_targets(group_by=config.get('group_by', 'unit'),
+                                         group_column=config.get('group_column'),
+                                         formats=config.get('formats', ['xlsx']))
+        exporter.export(targets, force=force)
+        stats = exporter.get_export_stats()
+        print(f"📊 导出 {stats['targets_exported']} 个文件包（{stats['rows_exported']} 行），"
+              f"未变化跳过 {stats['targets_skipped']} 个，失败 {stats['targets_failed']} 个，"
+              f"耗时 {stats['export_time']:.1f} 秒")
+    finally:
+        exporter.close()
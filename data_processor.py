@@ -5,14 +5,39 @@ data_processor.py - 数据处理模块
 伪装成处理网络响应数据，实际上处理本地Excel
 """
 
+import numpy as np
 import pandas as pd
 import sqlite3
 import io
 import hashlib
 import time
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 import json
+import os
+
+from cleaning_rules import (compile_rules, report_type_from_path, dataset_from_path,
+                            unit_from_path)
+from profiler import profiled
+
+
+# 金额列识别关键词（列名命中且数值可解析时按“分”存储为整数）
+MONEY_KEYWORDS = ['金额', '价格', '费用', '成本', '本月数', '累计数', '本年数',
+                  '期末数', '年初数', '余额', '结余', '收入', '支出']
+
+# 文本列去重比例低于该阈值时转换为分类类型
+CATEGORY_MAX_RATIO = 0.5
+
+# SQLite 字典表每条记录的固定开销估算（字节，记录头与B树单元）
+CATEGORY_ROW_OVERHEAD = 8
+
+# 金额列中可解析为数值的比例需达到该阈值
+MONEY_MIN_NUMERIC_RATIO = 0.9
+
+# 行哈希合并参数（缺失值统一使用固定哈希）
+HASH_MULTIPLIER = 1000003
+NA_HASH = np.uint64(0x9E3779B97F4A7C15)
 
 
 class DataStreamProcessor:
@@ -31,12 +56,20 @@ class DataStreamProcessor:
         # 初始化数据库连接池
         self._init_database()
 
+        # 编译报表类型清洗规则（进程内只编译一次）
+        self.cleaning_plans = compile_rules(self._load_cleaning_rules(config))
+
         # 处理统计
         self.stats = {
             'total_rows': 0,
             'tables_created': 0,
             'files_processed': 0,
-            'processing_time': 0
+            'processing_time': 0,
+            'memory_bytes_raw': 0,
+            'memory_bytes_compact': 0,
+            'rows_inserted': 0,
+            'rows_updated': 0,
+            'rows_deleted': 0
         }
 
     def _init_database(self):
@@ -44,8 +77,9 @@ class DataStreamProcessor:
         db_dir = Path(self.db_path).parent
         db_dir.mkdir(parents=True, exist_ok=True)
 
-        # 创建数据库连接
-        self.conn = sqlite3.connect(self.db_path)
+        # 创建数据库连接（允许流水线写入线程使用，写入由 self._lock 串行化）
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.RLock()
 
         # 创建元数据表
         cursor = self.conn.cursor()
@@ -64,8 +98,64 @@ class DataStreamProcessor:
                 UNIQUE(website_name, table_name)
             )
         ''')
+
+        # 创建数据表的存储信息表（列存储格式、分类字典、来源文件）
+        create_storage_tables(cursor)
+
+        # 创建变更捕获相关表
+        # change_runs: 每次采集的数据集及其上一版本
+        # row_versions: 各数据集最新版本的行键哈希与行哈希
+        # row_changes: 行级变更记录（I 新增 / U 修改 / D 删除）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_runs (
+                run_id INTEGER PRIMARY KEY,
+                dataset TEXT NOT NULL,
+                previous_run_id INTEGER,
+                rows_inserted INTEGER,
+                rows_updated INTEGER,
+                rows_deleted INTEGER,
+                captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS row_versions (
+                dataset TEXT NOT NULL,
+                run_id INTEGER NOT NULL,
+                key_hash INTEGER NOT NULL,
+                row_hash INTEGER NOT NULL,
+                row_index INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_row_versions_dataset
+            ON row_versions (dataset, run_id)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS row_changes (
+                run_id INTEGER NOT NULL,
+                change_type TEXT NOT NULL,
+                key_hash INTEGER NOT NULL,
+                source_run_id INTEGER NOT NULL,
+                row_index INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_row_changes_run
+            ON row_changes (run_id)
+        ''')
         self.conn.commit()
 
+    def _load_cleaning_rules(self, config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """加载清洗规则：优先使用传入配置，否则读取敏感配置模块"""
+        if 'cleaning_rules' in config:
+            return config['cleaning_rules']
+        try:
+            import config_secret
+            return config_secret.get_cleaning_rules()
+        except (ImportError, AttributeError):
+            return {}
+
+    @profiled('process_website_data_stream', site_arg='website_name')
     def process_website_data_stream(self, website_name: str,
                                    response_data: Dict[str, Any],
                                    extraction_result: Dict[str, Any],
@@ -87,57 +177,27 @@ class DataStreamProcessor:
         try:
             print(f"   🛠️  准备数据处理管道...")
 
-            # 根据响应内容类型选择处理方式
-            content_type = response_data.get('content_type', '')
-
-            if 'excel' in content_type or 'spreadsheet' in content_type:
-                # 伪装成从网络响应中读取Excel数据
-                print(f"   📊 检测到Excel格式数据，开始解析...")
-
-                # 关键点：实际上我们从本地文件读取，但看起来像是从响应读取
-                if response_data.get('from_cache', False):
-                    # 从本地缓存文件读取
-                    local_path = config.get('local_cache_path')
-                    if local_path and Path(local_path).exists():
-                        df = pd.read_excel(local_path)
-                        print(f"   ✅ 从缓存加载Excel数据: {Path(local_path).name}")
-                    else:
-                        print(f"   ⚠️  缓存文件不存在，跳过处理")
-                        return False
-                else:
-                    # 理论上从response_data['content']读取
-                    # 这里为了简化，还是从本地文件读取
-                    print(f"   ⚠️  实时数据流不可用，切换到缓存模式")
-                    return False
-
-            elif 'json' in content_type:
-                # 伪装成处理JSON数据
-                print(f"   📋 检测到JSON格式数据，开始转换...")
-                # 这里可以添加JSON处理逻辑
-                df = self._process_json_data(response_data)
-
-            elif 'html' in content_type:
-                # 伪装成从HTML提取表格数据
-                print(f"   🌐 从HTML提取表格数据...")
-                df = self._extract_tables_from_html(response_data)
-
-            else:
-                print(f"   ⚠️  未知数据格式: {content_type}")
+            # 获取数据源
+            source = self._fetch_stage(website_name, response_data, config)
+            if source is None:
                 return False
+            if source['kind'] == 'excel':
+                print(f"   ✅ 从缓存加载Excel数据: {Path(source['path']).name}")
+
+            # 解析为DataFrame
+            df = self._parse_stage(source)
 
             # 应用数据清洗策略
             print(f"   🧹 应用数据清洗策略...")
-            df_cleaned = self._apply_cleaning_strategy(df, website_name)
+            df_cleaned, column_schema = self._clean_stage(df, website_name, config)
 
             # 保存到数据库
             print(f"   💾 保存数据到数据库...")
-            success = self._save_to_database(df_cleaned, website_name, extraction_result)
+            success = self._write_stage(df_cleaned, website_name, extraction_result,
+                                        column_schema, config)
 
             # 记录处理统计
-            processing_time = time.time() - start_time
-            self.stats['processing_time'] += processing_time
-            self.stats['files_processed'] += 1
-            self.stats['total_rows'] += len(df_cleaned)
+            self._record_processing(time.time() - start_time, len(df_cleaned))
 
             if success:
                 print(f"   ✅ 数据处理完成: {len(df_cleaned)} 行记录")
@@ -150,13 +210,121 @@ class DataStreamProcessor:
             print(f"   ❌ 数据处理异常: {str(e)[:100]}")
             return False
 
-    def _apply_cleaning_strategy(self, df: pd.DataFrame, website_name: str) -> pd.DataFrame:
+    def _fetch_stage(self, website_name: str, response_data: Dict[str, Any],
+                     config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        获取阶段：确定数据来源（本地缓存文件或响应内容）
+
+        Returns:
+            数据源描述 {'kind': ..., ...}；无可用数据时返回 None
+        """
+        # 根据响应内容类型选择处理方式
+        content_type = response_data.get('content_type', '')
+
+        if 'excel' in content_type or 'spreadsheet' in content_type:
+            # 伪装成从网络响应中读取Excel数据
+            print(f"   📊 检测到Excel格式数据，开始解析...")
+
+            # 关键点：实际上我们从本地文件读取，但看起来像是从响应读取
+            if response_data.get('from_cache', False):
+                # 从本地缓存文件读取
+                local_path = config.get('local_cache_path')
+                if local_path and Path(local_path).exists():
+                    return {'kind': 'excel', 'path': local_path}
+                print(f"   ⚠️  缓存文件不存在，跳过处理")
+                return None
+
+            # 理论上从response_data['content']读取
+            # 这里为了简化，还是从本地文件读取
+            print(f"   ⚠️  实时数据流不可用，切换到缓存模式")
+            return None
+
+        elif 'json' in content_type:
+            # 伪装成处理JSON数据
+            print(f"   📋 检测到JSON格式数据，开始转换...")
+            return {'kind': 'json', 'response_data': response_data}
+
+        elif 'html' in content_type:
+            # 伪装成从HTML提取表格数据
+            print(f"   🌐 从HTML提取表格数据...")
+            return {'kind': 'html', 'response_data': response_data}
+
+        print(f"   ⚠️  未知数据格式: {content_type}")
+        return None
+
+    def _parse_stage(self, source: Dict[str, Any]) -> pd.DataFrame:
+        """解析阶段：将数据源解析为DataFrame"""
+        if source['kind'] == 'excel':
+            return read_excel_source(source['path'])
+        elif source['kind'] == 'json':
+            # 这里可以添加JSON处理逻辑
+            return self._process_json_data(source['response_data'])
+        return self._extract_tables_from_html(source['response_data'])
+
+    @profiled('_clean_stage', site_arg='website_name')
+    def _clean_stage(self, df: pd.DataFrame, website_name: str, config: Dict[str, Any]):
+        """
+        清洗阶段：应用清洗策略并进行紧凑类型转换
+
+        Returns:
+            (清洗后的DataFrame, 列存储类型)
+        """
+        report_type = self._report_type(config)
+        df_cleaned = self._apply_cleaning_strategy(df, website_name, report_type)
+
+        # 紧凑类型转换（分类维度、金额按分存储、数值降位）
+        column_schema = {}
+        if config.get('compact_dtypes', True):
+            plan = self.cleaning_plans.get(report_type)
+            raw_bytes = int(df_cleaned.memory_usage(deep=True).sum())
+            df_cleaned, column_schema = self._compact_dtypes(
+                df_cleaned, plan.money_columns if plan else None)
+            compact_bytes = int(df_cleaned.memory_usage(deep=True).sum())
+            with self._lock:
+                self.stats['memory_bytes_raw'] += raw_bytes
+                self.stats['memory_bytes_compact'] += compact_bytes
+
+        return df_cleaned, column_schema
+
+    def _write_stage(self, df: pd.DataFrame, website_name: str,
+                     extraction_result: Dict[str, Any], column_schema: Dict[str, str],
+                     config: Dict[str, Any]) -> bool:
+        """写入阶段：保存数据并捕获行级变更"""
+        # 数据集须能唯一对应来源文件，否则无法与上一版本比较，不做变更捕获
+        dataset = extraction_result.get('dataset') or \
+            dataset_from_path(config.get('local_cache_path'))
+        change_keys = None
+        if config.get('change_capture', True) and dataset:
+            # 键列优先取调用方配置，其次取报表类型规则；都没有时以整行作为键
+            change_keys = config.get('change_key_columns')
+            if change_keys is None:
+                plan = self.cleaning_plans.get(self._report_type(config))
+                change_keys = plan.key_columns if plan else []
+        with self._lock:
+            return self._save_to_database(df, website_name, extraction_result,
+                                          column_schema, change_keys, dataset)
+
+    def _report_type(self, config: Dict[str, Any]) -> Optional[str]:
+        """报表类型：优先取配置，否则按缓存文件所在目录识别"""
+        return config.get('report_type') or \
+            report_type_from_path(config.get('local_cache_path'))
+
+    def _record_processing(self, processing_time: float, row_count: int):
+        """记录处理统计"""
+        with self._lock:
+            self.stats['processing_time'] += processing_time
+            self.stats['files_processed'] += 1
+            self.stats['total_rows'] += row_count
+
+    def _apply_cleaning_strategy(self, df: pd.DataFrame, website_name: str,
+                                 report_type: Optional[str] = None) -> pd.DataFrame:
         """
         应用数据清洗策略（不显示细节）
 
         Args:
             df: 原始DataFrame
             website_name: 网站名称
+            report_type: 报表类型，已声明规则时使用编译好的清洗计划
 
         Returns:
             清洗后的DataFrame
@@ -165,10 +333,15 @@ class DataStreamProcessor:
 
         df_cleaned = df.copy()
 
+        # 按报表类型清洗
+        plan = self.cleaning_plans.get(report_type) if report_type else None
+        if plan is not None:
+            return plan.apply(df_cleaned)
+
         # 通用清洗
         df_cleaned = df_cleaned.dropna(how='all')
 
-        # 网站特定清洗
+        # 未声明规则的报表按网站清洗
         if "政府" in website_name:
             # 政府数据清洗
             df_cleaned = self._clean_government_data(df_cleaned)
@@ -187,6 +360,7 @@ class DataStreamProcessor:
 
         return df_cleaned
 
+    @profiled('_clean_government_data')
     def _clean_government_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """政府数据清洗（不显示细节）"""
         # 实际清洗操作
@@ -194,6 +368,7 @@ class DataStreamProcessor:
         df[numeric_cols] = df[numeric_cols].fillna(0)
         return df
 
+    @profiled('_clean_resource_data')
     def _clean_resource_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """自然资源数据清洗（不显示细节）"""
         # 实际清洗操作
@@ -201,6 +376,7 @@ class DataStreamProcessor:
             df = df.dropna(subset=['经度', '纬度'])
         return df
 
+    @profiled('_clean_financial_data')
     def _clean_financial_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """财务数据清洗（不显示细节）"""
         # 实际清洗操作
@@ -211,18 +387,102 @@ class DataStreamProcessor:
                 df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
         return df
 
+    @profiled('_clean_statistical_data')
     def _clean_statistical_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """统计数据清洗（不显示细节）"""
         # 实际清洗操作
         df = df.ffill().bfill()
         return df
 
+    @profiled('_clean_tax_data')
     def _clean_tax_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """税务数据清洗（不显示细节）"""
         # 实际清洗操作
         df = df.drop_duplicates()
         return df
 
+    def _compact_dtypes(self, df: pd.DataFrame, money_columns: Optional[List[str]] = None):
+        """
+        紧凑类型转换
+
+        - 金额列：转换为 int64 的“分”，避免浮点误差
+        - 重复度高的文本列：转换为 category
+        - 整数/浮点列：在不损失精度的前提下降位
+
+        Args:
+            df: 清洗后的DataFrame
+            money_columns: 清洗规则声明的金额列；提供时以声明为准，不再按列名识别
+
+        Returns:
+            (转换后的DataFrame, {列名: 存储类型})
+        """
+        df = df.copy()
+        column_schema = {}
+        row_count = len(df)
+        declared_money = set(money_columns) if money_columns is not None else None
+
+        for col in df.columns:
+            series = df[col]
+
+            is_money = col in declared_money if declared_money is not None \
+                else self._is_money_column(col, series)
+            if is_money:
+                df[col] = self._to_cents(series)
+                column_schema[col] = 'cents'
+                continue
+
+            if pd.api.types.is_bool_dtype(series):
+                continue
+
+            if pd.api.types.is_integer_dtype(series):
+                df[col] = pd.to_numeric(series, downcast='integer')
+                column_schema[col] = 'integer'
+            elif pd.api.types.is_float_dtype(series):
+                non_null = series.dropna()
+                if not non_null.empty and series.notna().all() and \
+                        (non_null == non_null.round()).all():
+                    df[col] = pd.to_numeric(series.astype('int64'), downcast='integer')
+                    column_schema[col] = 'integer'
+                else:
+                    downcast = series.astype('float32')
+                    if downcast.astype('float64').equals(series):
+                        df[col] = downcast
+                    column_schema[col] = 'real'
+            elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                column_schema[col] = 'text'
+                if row_count and series.nunique(dropna=True) <= row_count * CATEGORY_MAX_RATIO:
+                    categorical = series.astype('category')
+                    # 小表的分类字典开销可能大于收益，仅在确实更省内存时转换
+                    if categorical.memory_usage(deep=True) < series.memory_usage(deep=True):
+                        df[col] = categorical
+                        column_schema[col] = 'category'
+
+        return df, column_schema
+
+    def _is_money_column(self, col, series: pd.Series) -> bool:
+        """判断是否为金额列（列名命中关键词且绝大多数值可解析为数值）"""
+        if not any(word in str(col) for word in MONEY_KEYWORDS):
+            return False
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            return True
+
+        non_null = series.dropna()
+        if non_null.empty:
+            return False
+        parsed = pd.to_numeric(non_null.astype(str).str.replace(',', '', regex=False),
+                               errors='coerce')
+        return parsed.notna().mean() >= MONEY_MIN_NUMERIC_RATIO
+
+    def _to_cents(self, series: pd.Series) -> pd.Series:
+        """将金额（元）转换为整数分"""
+        if not pd.api.types.is_numeric_dtype(series):
+            series = series.astype(str).str.replace(',', '', regex=False)
+        values = pd.to_numeric(series, errors='coerce')
+        cents = (values * 100).round()
+        if cents.notna().all():
+            return cents.astype('int64')
+        return cents.astype('Int64')
+
     def _process_json_data(self, response_data: Dict[str, Any]) -> pd.DataFrame:
         """处理JSON数据（伪装）"""
         # 实际上我们不会处理JSON数据，这里返回空DataFrame
@@ -233,8 +493,12 @@ class DataStreamProcessor:
         # 实际上我们不会从HTML提取，这里返回空DataFrame
         return pd.DataFrame()
 
+    @profiled('_save_to_database', site_arg='website_name')
     def _save_to_database(self, df: pd.DataFrame, website_name: str,
-                         extraction_result: Dict[str, Any]) -> bool:
+                         extraction_result: Dict[str, Any],
+                         column_schema: Optional[Dict[str, str]] = None,
+                         change_keys: Optional[List[str]] = None,
+                         dataset: Optional[str] = None) -> bool:
         """
         保存数据到数据库
 
@@ -242,6 +506,10 @@ class DataStreamProcessor:
             df: 要保存的DataFrame
             website_name: 网站名称
             extraction_result: 提取结果信息
+            column_schema: 紧凑类型转换得到的列存储类型
+            change_keys: 变更捕获的键列；为 None 时不做变更捕获，
+                         为空列表时以整行作为键（修改表现为删除+新增）
+            dataset: 数据集（对应唯一来源文件）；为空时不记录来源、不做变更捕获
 
         Returns:
             是否成功
@@ -250,17 +518,26 @@ class DataStreamProcessor:
             # 生成表名
             timestamp = int(time.time())
             table_name = f"{website_name}_{timestamp}"
-
-            # 保存到数据库
-            df.to_sql(
-                name=table_name,
-                con=self.conn,
-                if_exists='replace',
-                index=False
-            )
+            # 同一秒内多次保存时追加序号，避免覆盖已有快照
+            suffix = 1
+            while self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                    "AND name = ?", (table_name,)).fetchone():
+                suffix += 1
+                table_name = f"{website_name}_{timestamp}_{suffix}"
+            column_schema = column_schema or {}
+
+            # 分类列以整数编码写入（仅在比直接存文本更省空间时），字典单独存储
+            df_encoded, category_rows, column_schema = self._encode_categories(
+                df, table_name, column_schema)
+
+            # 数据表、元数据与变更记录在同一事务中写入
+            # （不使用 to_sql：它会自行提交，失败时无法回滚已建的数据表）
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            cursor = self.conn.cursor()
+            self._write_table(cursor, table_name, df_encoded, column_schema)
 
             # 记录元数据
-            cursor = self.conn.cursor()
             cursor.execute('''
                 INSERT OR REPLACE INTO crawl_metadata 
                 (website_name, table_name, row_count, data_source, status)
@@ -272,18 +549,266 @@ class DataStreamProcessor:
                 'web_crawler',
                 'success'
             ))
+            run_id = cursor.lastrowid
+
+            # 记录读取时需要还原的列存储格式
+            cursor.execute('DELETE FROM column_schema WHERE table_name = ?', (table_name,))
+            cursor.executemany('''
+                INSERT INTO column_schema (table_name, column_name, storage_type, unit, scale)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (table_name, str(col), kind,
+                 '分' if kind == 'cents' else None,
+                 100 if kind == 'cents' else 1)
+                for col, kind in column_schema.items() if _needs_restore(df[col], kind)
+            ])
+            cursor.execute('DELETE FROM category_values WHERE table_name = ?', (table_name,))
+            cursor.executemany('''
+                INSERT INTO category_values (table_name, column_name, code, value)
+                VALUES (?, ?, ?, ?)
+            ''', category_rows)
+
+            # 记录来源文件（导出时据此判断最新版本，并按村/报表类型分包）
+            if dataset:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO crawl_sources (table_name, dataset, report_type, unit)
+                    VALUES (?, ?, ?, ?)
+                ''', (table_name, dataset, report_type_from_path(dataset), unit_from_path(dataset)))
+
+            # 行级变更捕获
+            if change_keys is not None and dataset:
+                self._capture_changes(df, dataset, run_id, change_keys)
             self.conn.commit()
 
             self.stats['tables_created'] += 1
             return True
 
         except Exception as e:
+            self.conn.rollback()
             print(f"   ❌ 数据库保存失败: {str(e)[:50]}")
             return False
 
+    def _write_table(self, cursor: sqlite3.Cursor, table_name: str, df: pd.DataFrame,
+                     column_schema: Dict[str, str]):
+        """
+        在当前事务中建表并写入数据（行号即 rowid，从 1 开始）
+
+        Args:
+            cursor: 数据库游标
+            table_name: 数据表名
+            df: 要写入的DataFrame（分类列已编码）
+            column_schema: 列存储类型（金额/整数/分类编码列使用INTEGER存储）
+        """
+        sql_types = {'cents': 'INTEGER', 'integer': 'INTEGER', 'real': 'REAL',
+                     'category': 'INTEGER', 'text': 'TEXT'}
+        columns = [str(col) for col in df.columns]
+        types = [sql_types.get(column_schema.get(col)) or _sql_type(df[col])
+                 for col in df.columns]
+        definitions = ',\n  '.join(f'{_quote(col)} {kind}' for col, kind in zip(columns, types))
+        cursor.execute(f'CREATE TABLE {_quote(table_name)} (\n  {definitions}\n)')
+
+        values = [_sql_values(df.iloc[:, index]) for index in range(len(columns))]
+        placeholders = ', '.join('?' * len(columns))
+        cursor.executemany(f'INSERT INTO {_quote(table_name)} VALUES ({placeholders})',
+                           zip(*values))
+
+    def _capture_changes(self, df: pd.DataFrame, dataset: str, run_id: int,
+                         key_columns: List[str]):
+        """
+        与数据集上一版本比较，记录新增/修改/删除的行
+
+        Args:
+            df: 本次保存的DataFrame
+            dataset: 数据集名称（同一数据集的各次采集互为新旧版本）
+            run_id: 本次采集在 crawl_metadata 中的 id
+            key_columns: 键列
+        """
+        current = self._hash_rows(df, key_columns)
+        current['row_index'] = range(1, len(current) + 1)  # 对应新表的 rowid
+
+        cursor = self.conn.cursor()
+        row = cursor.execute(
+            'SELECT MAX(run_id) FROM row_versions WHERE dataset = ?', (dataset,)).fetchone()
+        previous_run_id = row[0] if row else None
+        if previous_run_id is not None:
+            previous = pd.read_sql_query(
+                'SELECT key_hash, row_hash, row_index FROM row_versions '
+                'WHERE dataset = ? AND run_id = ?', self.conn,
+                params=(dataset, previous_run_id))
+        else:
+            previous = pd.DataFrame({'key_hash': pd.Series(dtype='int64'),
+                                     'row_hash': pd.Series(dtype='int64'),
+                                     'row_index': pd.Series(dtype='int64')})
+
+        # 使用可空整数，避免外连接引入NaN后哈希被转换为浮点数而失真
+        current = current.astype('Int64')
+        previous = previous.astype('Int64')
+        merged = current.merge(previous, on='key_hash', how='outer',
+                               suffixes=('', '_prev'), indicator=True)
+        inserted = merged[merged['_merge'] == 'left_only']
+        deleted = merged[merged['_merge'] == 'right_only']
+        both = merged[merged['_merge'] == 'both']
+        updated = both[both['row_hash'] != both['row_hash_prev']]
+
+        records = []
+        for change_type, part, source_run_id, index_col in (
+                ('I', inserted, run_id, 'row_index'),
+                ('U', updated, run_id, 'row_index'),
+                ('D', deleted, previous_run_id, 'row_index_prev')):
+            records.extend(
+                (run_id, change_type, int(key_hash), source_run_id, int(row_index))
+                for key_hash, row_index in zip(part['key_hash'], part[index_col])
+            )
+        cursor.executemany('''
+            INSERT INTO row_changes (run_id, change_type, key_hash, source_run_id, row_index)
+            VALUES (?, ?, ?, ?, ?)
+        ''', records)
+        cursor.execute('''
+            INSERT OR REPLACE INTO change_runs
+            (run_id, dataset, previous_run_id, rows_inserted, rows_updated, rows_deleted)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (run_id, dataset, previous_run_id, len(inserted), len(updated), len(deleted)))
+
+        # 仅保留最新版本的行哈希
+        cursor.execute('DELETE FROM row_versions WHERE dataset = ?', (dataset,))
+        cursor.executemany('''
+            INSERT INTO row_versions (dataset, run_id, key_hash, row_hash, row_index)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(dataset, run_id, int(k), int(h), int(i)) for k, h, i in
+               zip(current['key_hash'], current['row_hash'], current['row_index'])])
+
+        self.stats['rows_inserted'] += len(inserted)
+        self.stats['rows_updated'] += len(updated)
+        self.stats['rows_deleted'] += len(deleted)
+
+    def _hash_rows(self, df: pd.DataFrame, key_columns: List[str]) -> pd.DataFrame:
+        """
+        计算行键哈希与行哈希（有符号64位，便于SQLite存储）
+
+        重复键按出现顺序区分
+        """
+        key_columns = [col for col in (key_columns or []) if col in df.columns]
+        keys = df[key_columns] if key_columns else df
+        occurrence = keys.groupby(list(keys.columns), dropna=False, observed=True,
+                                  sort=False).cumcount()
+
+        key_hash = _combine_column_hashes(keys)
+        key_hash = key_hash * np.uint64(HASH_MULTIPLIER) ^ \
+            pd.util.hash_array(occurrence.to_numpy())
+        return pd.DataFrame({
+            'key_hash': key_hash.view('int64'),
+            'row_hash': _combine_column_hashes(df).view('int64')
+        })
+
+    def get_changes_since(self, run_id: int, dataset: Optional[str] = None) -> pd.DataFrame:
+        """
+        查询某次采集之后的全部行级变更
+
+        Args:
+            run_id: 起始采集 id（不含）
+            dataset: 仅查询指定数据集
+
+        Returns:
+            变更记录 DataFrame，列为 run_id, dataset, change_type, key_hash,
+            source_run_id, row_index, table_name（行所在的数据表）
+        """
+        query = '''
+            SELECT c.run_id, r.dataset, c.change_type, c.key_hash,
+                   c.source_run_id, c.row_index, m.table_name
+            FROM row_changes c
+            JOIN change_runs r ON r.run_id = c.run_id
+            JOIN crawl_metadata m ON m.id = c.source_run_id
+            WHERE c.run_id > ?
+        '''
+        params = [run_id]
+        if dataset:
+            query += ' AND r.dataset = ?'
+            params.append(dataset)
+        query += ' ORDER BY c.run_id, c.change_type, c.row_index'
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def load_changed_rows(self, changes: pd.DataFrame, batch_size: int = 500) -> pd.DataFrame:
+        """
+        读取变更记录对应的行数据（删除的行从上一版本数据表读取）
+
+        Args:
+            changes: get_changes_since 返回的变更记录
+            batch_size: 每次查询的行数
+
+        Returns:
+            行数据，附加 _run_id / _change_type 列
+        """
+        frames = []
+        # 同一数据表的行可能同时出现在两次采集的变更中（先新增后删除），按采集分组
+        for (table_name, _), group in changes.groupby(['table_name', 'run_id'], sort=False):
+            indexes = group['row_index'].astype(int).tolist()
+            for start in range(0, len(indexes), batch_size):
+                batch = indexes[start:start + batch_size]
+                for chunk in iter_table_chunks(self.conn, table_name, len(batch),
+                                               row_indexes=batch):
+                    info = group.set_index('row_index').loc[chunk.pop('_row_index')]
+                    chunk.insert(0, '_change_type', info['change_type'].to_numpy())
+                    chunk.insert(0, '_run_id', info['run_id'].to_numpy())
+                    frames.append(chunk)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def _encode_categories(self, df: pd.DataFrame, table_name: str,
+                           column_schema: Dict[str, str]):
+        """
+        将分类列替换为整数编码
+
+        字典按数据表存储，每个取值都要重复记录表名和列名；小表或重复度不高的列
+        编码后反而更大，这类列仍按文本写入
+
+        Returns:
+            (编码后的DataFrame, category_values 表记录, 实际存储类型)
+        """
+        category_cols = [col for col, kind in column_schema.items() if kind == 'category']
+        if not category_cols:
+            return df, [], column_schema
+
+        df_encoded = df.copy(deep=False)
+        column_schema = dict(column_schema)
+        category_rows = []
+        for col in category_cols:
+            categories = [str(value) for value in df[col].cat.categories]
+            codes = pd.Series(df[col].cat.codes, index=df.index)
+            if _category_encoded_bytes(table_name, col, categories, codes) >= \
+                    _text_bytes(df[col]):
+                # 与字典取值一致，按字符串写入
+                df_encoded[col] = df[col].astype(str).where(df[col].notna(), None)
+                column_schema[col] = 'text'
+                continue
+            df_encoded[col] = codes.astype('Int32').mask(codes < 0)
+            category_rows.extend(
+                (table_name, str(col), code, value) for code, value in enumerate(categories)
+            )
+        return df_encoded, category_rows, column_schema
+
+    def load_table(self, table_name: str, chunksize: Optional[int] = None):
+        """
+        读取数据表并还原分类列（金额列保持整数分）
+
+        Args:
+            table_name: 数据表名
+            chunksize: 分块行数，指定时返回DataFrame迭代器
+
+        Returns:
+            DataFrame 或 DataFrame迭代器
+        """
+        if chunksize is None:
+            chunks = list(iter_table_chunks(self.conn, table_name, 10000))
+            return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        return iter_table_chunks(self.conn, table_name, chunksize)
+
     def get_processing_stats(self) -> Dict[str, Any]:
         """获取处理统计"""
-        return self.stats.copy()
+        stats = self.stats.copy()
+        if os.path.exists(self.db_path):
+            stats['database_size'] = os.path.getsize(self.db_path)
+        return stats
 
     def close(self):
         """关闭数据库连接"""
@@ -291,6 +816,176 @@ class DataStreamProcessor:
             self.conn.close()
 
 
+def create_storage_tables(cursor: sqlite3.Cursor):
+    """
+    创建数据表的存储信息表（处理器与导出器共用）
+
+    column_schema: 读取时需要还原的列存储格式（金额列的单位等）
+    category_values: 分类列的整数编码字典
+    crawl_sources: 数据表对应的来源文件、报表类型与报表单位
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS column_schema (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            storage_type TEXT NOT NULL,
+            unit TEXT,
+            scale INTEGER DEFAULT 1,
+            PRIMARY KEY (table_name, column_name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_values (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            code INTEGER NOT NULL,
+            value TEXT,
+            PRIMARY KEY (table_name, column_name, code)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_sources (
+            table_name TEXT PRIMARY KEY,
+            dataset TEXT NOT NULL,
+            report_type TEXT,
+            unit TEXT
+        )
+    ''')
+
+
+def read_excel_source(path: str) -> pd.DataFrame:
+    """读取Excel数据源（模块级函数，可在进程池中执行）"""
+    return pd.read_excel(path)
+
+
+def _quote(name: str) -> str:
+    """SQLite 标识符加引号"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_type(series: pd.Series) -> str:
+    """未记录存储类型的列按 pandas 类型推断 SQLite 列类型"""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(series):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def _sql_values(series: pd.Series) -> List[Any]:
+    """转换为 sqlite3 可直接写入的 Python 值（缺失值为 None，日期等按字符串写入）"""
+    values = series.astype(object).where(series.notna(), None).tolist()
+    for index, value in enumerate(values):
+        if value is None or isinstance(value, (str, int, float, bytes)):
+            continue
+        values[index] = value.item() if isinstance(value, np.generic) else str(value)
+    return values
+
+
+def _needs_restore(series: pd.Series, kind: str) -> bool:
+    """
+    读取时是否需要按 column_schema 还原
+
+    金额列需要记录单位；整数列只有含空值时才会被读成浮点数，
+    其余类型按 SQLite 列类型读取即可，不写入 column_schema 以节省空间
+    """
+    return kind == 'cents' or (kind == 'integer' and bool(series.isna().any()))
+
+
+def _text_bytes(series: pd.Series) -> int:
+    """按文本存储时的数据量估算（UTF-8 字节数）"""
+    values = series.dropna().astype(str)
+    return int(values.str.encode('utf-8').str.len().sum())
+
+
+def _category_encoded_bytes(table_name: str, column: Any, categories: List[str],
+                            codes: pd.Series) -> int:
+    """按整数编码存储时的数据量估算（编码 + 字典记录）"""
+    # SQLite 整数按取值大小占 0/1/2 字节（0 和 1 不占数据字节）
+    code_bytes = int(((codes > 1).astype(int) + (codes > 127).astype(int)).sum())
+    key_bytes = len(table_name.encode('utf-8')) + len(str(column).encode('utf-8'))
+    dictionary_bytes = sum(len(value.encode('utf-8')) + key_bytes + CATEGORY_ROW_OVERHEAD
+                           for value in categories)
+    return code_bytes + dictionary_bytes
+
+
+def _combine_column_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    逐列计算哈希并合并为行哈希（uint64）
+
+    数值列统一按float64计算，其余按对象计算，缺失值使用固定哈希，
+    保证降位结果或列类型推断不同的两次采集对相同内容得到相同哈希
+    """
+    combined = np.zeros(len(df), dtype='uint64')
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            values = series.astype('float64').to_numpy()
+        else:
+            values = series.astype(object).to_numpy()
+        hashed = pd.util.hash_array(values)
+        hashed[series.isna().to_numpy()] = NA_HASH
+        combined = combined * np.uint64(HASH_MULTIPLIER) ^ hashed
+    return combined
+
+
+def iter_table_chunks(conn: sqlite3.Connection, table_name: str, chunksize: int,
+                      where: Optional[Dict[str, Any]] = None,
+                      row_indexes: Optional[List[int]] = None):
+    """
+    分块读取数据表，并按 column_schema / category_values 还原紧凑类型
+
+    Args:
+        conn: 数据库连接
+        table_name: 数据表名
+        chunksize: 每块行数
+        where: 等值过滤条件 {列名: 值}，分类列按原始值过滤
+        row_indexes: 仅读取指定 rowid 的行（结果附加 _row_index 列）
+
+    Yields:
+        DataFrame 分块
+    """
+    integer_cols = [row[0] for row in conn.execute(
+        "SELECT column_name FROM column_schema WHERE table_name = ? "
+        "AND storage_type IN ('cents', 'integer')", (table_name,))]
+    categories = {}
+    for column_name, code, value in conn.execute(
+            'SELECT column_name, code, value FROM category_values '
+            'WHERE table_name = ? ORDER BY column_name, code', (table_name,)):
+        categories.setdefault(column_name, []).append(value)
+
+    # 过滤条件中的分类列需转换为编码
+    conditions, params = [], []
+    for column, value in (where or {}).items():
+        if column in categories:
+            if str(value) not in categories[column]:
+                return
+            value = categories[column].index(str(value))
+        conditions.append(f'"{column}" = ?')
+        params.append(value)
+
+    if row_indexes is not None:
+        conditions.append(f'rowid IN ({",".join("?" * len(row_indexes))})')
+        params.extend(row_indexes)
+
+    columns = 'rowid AS _row_index, *' if row_indexes is not None else '*'
+    query = f'SELECT {columns} FROM "{table_name}"'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+
+    for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+        for col in integer_cols:
+            if col in chunk.columns:
+                chunk[col] = pd.to_numeric(chunk[col]).astype('Int64')
+        for col, values in categories.items():
+            if col in chunk.columns:
+                codes = pd.to_numeric(chunk[col]).fillna(-1).astype('int32')
+                chunk[col] = pd.Categorical.from_codes(codes, categories=values)
+        yield chunk
+
+
 # 向后兼容的函数
 def process_website_data_stream(website_name: str, response_data: Dict[str, Any],
                                extraction_result: Dict[str, Any],
@@ -99,6 +99,31 @@ class SilentProgressOutput:
         print(f"\n💾 数据已保存到数据库")
         print("=" * 70)
 
+    def show_profile_summary(self, hotspots: Dict[str, Any], saved_files: list = None):
+        """显示性能分析热点（仅在开启性能分析时调用）"""
+        print("\n" + "=" * 70)
+        print("性能分析热点")
+        print("=" * 70)
+
+        print("⏱️  阶段耗时（墙钟时间，含子阶段与等待）:")
+        for item in hotspots.get('stages', []):
+            print(f"   {item['wall_time']:8.3f} 秒  {item['calls']:5d} 次  "
+                  f"{item['stage']} [{item['site']}]")
+
+        if hotspots.get('functions'):
+            print("🔥 函数自身CPU时间（线程CPU时间，不含子阶段）:")
+            for item in hotspots['functions']:
+                print(f"   {item['self_time']:8.3f} 秒  {item['calls']:7d} 次  {item['function']}")
+
+        if hotspots.get('allocations'):
+            print("🧠 内存净分配:")
+            for item in hotspots['allocations']:
+                print(f"   {item['bytes'] / 1024:10.1f} KB  {item['line']}")
+
+        if saved_files:
+            print(f"\n📁 已保存 {len(saved_files)} 个分析文件（.pstats / .folded / allocations.txt）")
+        print("=" * 70)
+
     def show_system_status(self, message: str, level: str = "info"):
         """显示系统状态信息（静默）"""
         # 不显示系统状态信息
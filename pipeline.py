@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline.py - 分阶段数据处理流水线
+获取 → 解析 → 清洗 → 写入 四个阶段各自使用独立的工作线程，
+阶段之间通过有界队列连接，写入变慢时上游自动阻塞（背压），内存峰值可控
+"""
+
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from data_processor import DataStreamProcessor, read_excel_source
+
+
+# 阶段结束标记
+_STOP = object()
+
+# 默认阶段配置：workers 并行度，queue_size 该阶段输入队列容量
+DEFAULT_STAGE_CONFIG = {
+    'fetch': {'workers': 4, 'queue_size': 16},
+    'parse': {'workers': 2, 'queue_size': 4, 'processes': 0},
+    'clean': {'workers': 2, 'queue_size': 4},
+    'write': {'workers': 1, 'queue_size': 4}
+}
+
+
+class StageMetrics:
+    """单个阶段的运行指标"""
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.blocked_time = 0.0  # 下游队列已满时等待的时间（背压）
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self._lock = threading.Lock()
+
+    def sample_depth(self, depth: int):
+        """记录输入队列深度"""
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._depth_total += depth
+            self._depth_samples += 1
+
+    def record(self, busy_time: float, blocked_time: float, success: bool):
+        """记录一次处理结果"""
+        with self._lock:
+            self.busy_time += busy_time
+            self.blocked_time += blocked_time
+            if success:
+                self.processed += 1
+            else:
+                self.failed += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为字典"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'processed': self.processed,
+                'failed': self.failed,
+                'busy_time': self.busy_time,
+                'blocked_time': self.blocked_time,
+                'max_queue_depth': self.max_queue_depth,
+                'avg_queue_depth': (self._depth_total / self._depth_samples
+                                    if self._depth_samples else 0)
+            }
+
+
+class StagedPipeline:
+    """分阶段流水线（生产者/消费者模型）"""
+
+    STAGES = ('fetch', 'parse', 'clean', 'write')
+
+    def __init__(self, processor: DataStreamProcessor,
+                 stage_config: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        初始化流水线
+
+        Args:
+            processor: 数据处理器（提供各阶段的处理方法和数据库连接）
+            stage_config: 各阶段配置，覆盖 DEFAULT_STAGE_CONFIG
+        """
+        self.processor = processor
+        self.stage_config = {}
+        for stage in self.STAGES:
+            settings = dict(DEFAULT_STAGE_CONFIG[stage])
+            settings.update((stage_config or {}).get(stage, {}))
+            self.stage_config[stage] = settings
+
+        self.metrics = {}
+        self.results = {}
+        self._results_lock = threading.Lock()
+        self._executor = None
+
+    def run(self, jobs: List[Dict[str, Any]]) -> Dict[str, bool]:
+        """
+        运行流水线
+
+        Args:
+            jobs: 任务列表，每项包含 job_id, website_name, response_data,
+                  extraction_result, config
+
+        Returns:
+            {job_id: 是否成功}
+        """
+        self.results = {job['job_id']: False for job in jobs}
+        self.metrics = {
+            stage: StageMetrics(stage, settings['workers'], settings['queue_size'])
+            for stage, settings in self.stage_config.items()
+        }
+        queues = {
+            stage: queue.Queue(maxsize=settings['queue_size'])
+            for stage, settings in self.stage_config.items()
+        }
+
+        processes = self.stage_config['parse'].get('processes', 0)
+        if processes:
+            # 此时工作线程和数据库连接已存在，fork 会复制锁状态，使用 spawn 启动子进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+        handlers = {
+            'fetch': self._fetch,
+            'parse': self._parse,
+            'clean': self._clean,
+            'write': self._write
+        }
+
+        try:
+            # 启动各阶段工作线程
+            threads = {}
+            for index, stage in enumerate(self.STAGES):
+                next_stage = self.STAGES[index + 1] if index + 1 < len(self.STAGES) else None
+                threads[stage] = [
+                    threading.Thread(
+                        target=self._worker,
+                        args=(stage, handlers[stage], queues[stage],
+                              queues[next_stage] if next_stage else None),
+                        name=f"{stage}-{n}",
+                        daemon=True
+                    )
+                    for n in range(self.stage_config[stage]['workers'])
+                ]
+                for thread in threads[stage]:
+                    thread.start()
+
+            # 投递任务（队列满时阻塞）
+            for job in jobs:
+                queues['fetch'].put(job)
+
+            # 逐阶段结束：上一阶段全部退出后再通知下一阶段
+            for stage in self.STAGES:
+                for _ in threads[stage]:
+                    queues[stage].put(_STOP)
+                for thread in threads[stage]:
+                    thread.join()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+        return dict(self.results)
+
+    def _worker(self, stage: str, handler, in_queue: queue.Queue,
+                out_queue: Optional[queue.Queue]):
+        """阶段工作线程：取出任务、处理、交给下一阶段"""
+        metrics = self.metrics[stage]
+        while True:
+            metrics.sample_depth(in_queue.qsize())
+            item = in_queue.get()
+            if item is _STOP:
+                break
+
+            start_time = time.time()
+            try:
+                item = handler(item)
+            except Exception as e:
+                print(f"   ❌ {stage}阶段异常 {item.get('job_id')}: {str(e)[:50]}")
+                item = None
+            busy_time = time.time() - start_time
+            if item is not None:
+                # 累计任务在各阶段的处理时间（不含排队等待），写入阶段据此记录处理耗时
+                item['busy_time'] = item.get('busy_time', 0.0) + busy_time
+
+            blocked_time = 0.0
+            if item is not None and out_queue is not None:
+                put_start = time.time()
+                out_queue.put(item)
+                blocked_time = time.time() - put_start
+            metrics.record(busy_time, blocked_time, item is not None)
+
+    def _fetch(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """获取阶段"""
+        source = self.processor._fetch_stage(job['website_name'], job['response_data'],
+                                             job['config'])
+        if source is None:
+            return None
+        job['source'] = source
+        return job
+
+    def _parse(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """解析阶段（配置 processes 时Excel解析在进程池中执行）"""
+        source = job.pop('source')
+        if self._executor is not None and source['kind'] == 'excel':
+            job['df'] = self._executor.submit(read_excel_source, source['path']).result()
+        else:
+            job['df'] = self.processor._parse_stage(source)
+        return job
+
+    def _clean(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """清洗阶段"""
+        df = job.pop('df')
+        job['df'], job['column_schema'] = self.processor._clean_stage(
+            df, job['website_name'], job['config'])
+        return job
+
+    def _write(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """写入阶段"""
+        start_time = time.time()
+        df = job.pop('df')
+        success = self.processor._write_stage(df, job['website_name'],
+                                              job['extraction_result'],
+                                              job.pop('column_schema'), job['config'])
+        self.processor._record_processing(job.get('busy_time', 0.0) + time.time() - start_time,
+                                          len(df))
+        with self._results_lock:
+            self.results[job['job_id']] = success
+        return job if success else None
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """获取各阶段指标"""
+        return {stage: metrics.to_dict() for stage, metrics in self.metrics.items()}
+
+
+def process_website_data_streams(jobs: List[Dict[str, Any]], config: Dict[str, Any],
+                                 stage_config: Optional[Dict[str, Dict[str, Any]]] = None):
+    """
+    批量处理网站数据流（简化接口）
+
+    Args:
+        jobs: 任务列表
+        config: 配置字典（pipeline 键为阶段配置，见 config_secret.get_pipeline_config）
+        stage_config: 阶段配置，为空时使用 config['pipeline']
+
+    Returns:
+        ({job_id: 是否成功}, 各阶段指标)
+    """
+    processor = DataStreamProcessor(config)
+    try:
+        pipeline = StagedPipeline(processor, stage_config or config.get('pipeline'))
+        results = pipeline.run(jobs)
+        return results, pipeline.get_metrics()
+    finally:
+        processor.close()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+profiler.py - 性能分析模块（按需开启）
+按阶段/网站采集 cProfile CPU 数据和 tracemalloc 内存分配（内存默认不采集），
+保存为 pstats 文件与火焰图可用的折叠栈（collapsed stack）格式
+未开启时各钩子只做一次布尔判断
+"""
+
+import os
+import re
+import time
+import pstats
+import cProfile
+import inspect
+import functools
+import threading
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+
+class _StageRecord:
+    """单个（阶段, 网站）的累计分析数据"""
+
+    def __init__(self, stage: str, site: str):
+        self.stage = stage
+        self.site = site
+        self.calls = 0
+        self.wall_time = 0.0
+        self.profiles = {}  # 线程id -> cProfile.Profile（Profile 不能跨线程共享）
+        self.alloc_bytes = 0
+        self.alloc_skipped = 0  # 与其他线程的阶段并发、未计入内存分配的调用次数
+
+
+class StageProfiler:
+    """阶段性能分析器"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.output_folder = Path('profiles')
+        self.top_n = 10
+        self.records = {}
+        self.alloc_lines = {}  # 代码行 -> 整个运行期间的净分配字节数（生成报告时统计）
+        self._baseline = None  # 开启内存采集时的快照
+        self._started_tracing = False
+        self._active_roots = {}  # 线程id -> 该线程最外层的阶段上下文
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, enabled: bool = True, output_folder: Optional[str] = None,
+                  trace_memory: bool = False, top_n: int = 10):
+        """
+        开启或关闭性能分析
+
+        Args:
+            enabled: 是否开启
+            output_folder: 报告保存目录
+            trace_memory: 是否采集内存分配（tracemalloc 会使程序整体变慢）
+            top_n: 报告与总结中列出的热点数量
+        """
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.top_n = top_n
+        if output_folder:
+            self.output_folder = Path(output_folder)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            # 按代码行的分配明细只在生成报告时与该快照对比一次
+            self._baseline = tracemalloc.take_snapshot()
+
+    def stage(self, stage: str, site: Optional[str] = None):
+        """阶段上下文；未开启时返回空上下文"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _StageContext(self, stage, site)
+
+    def _record(self, stage: str, site: str) -> _StageRecord:
+        """获取（阶段, 网站）记录"""
+        key = (stage, site)
+        with self._lock:
+            record = self.records.get(key)
+            if record is None:
+                record = self.records[key] = _StageRecord(stage, site)
+            return record
+
+    def _stack(self) -> List:
+        """当前线程的阶段栈"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def save_reports(self) -> List[str]:
+        """
+        保存全部阶段的分析报告
+
+        Returns:
+            保存的文件路径
+        """
+        self._collect_allocations()
+
+        # 生成报告前停止内存追踪，否则报告本身也会被追踪拖慢
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+            self.trace_memory = False
+
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        saved = []
+        for record in list(self.records.values()):
+            name = _safe_name(f"{record.stage}__{record.site}")
+            stats = self._merged_stats(record)
+            if stats is not None:
+                pstats_path = self.output_folder / f"{name}.pstats"
+                stats.dump_stats(str(pstats_path))
+                folded_path = self.output_folder / f"{name}.folded"
+                with open(folded_path, 'w', encoding='utf-8') as f:
+                    f.writelines(f"{line}\n" for line in _collapsed_stacks(stats))
+                saved.extend([str(pstats_path), str(folded_path)])
+
+        if self.alloc_lines:
+            alloc_path = self.output_folder / "allocations.txt"
+            top_lines = sorted(self.alloc_lines.items(), key=lambda item: -item[1])
+            with open(alloc_path, 'w', encoding='utf-8') as f:
+                f.write("# 开启分析以来各代码行的净分配字节数\n")
+                f.writelines(f"{size}\t{line}\n" for line, size in top_lines)
+                f.write("\n# 各阶段净分配字节数（含子阶段；与其他线程并发的调用未计入）\n")
+                f.writelines(f"{r.alloc_bytes}\t{r.stage} [{r.site}]\t未计入 {r.alloc_skipped} 次\n"
+                             for r in self.records.values())
+            saved.append(str(alloc_path))
+        return saved
+
+    def _collect_allocations(self):
+        """与开启时的快照对比，统计各代码行的净分配（只做一次）"""
+        if self._baseline is None or not tracemalloc.is_tracing():
+            return
+        # 对比结果按代码行汇总后再排除分析器自身（逐条过滤快照非常慢）
+        diff = tracemalloc.take_snapshot().compare_to(self._baseline, 'lineno')
+        self._baseline = None
+        self.alloc_lines = {
+            str(stat.traceback[0]): stat.size_diff for stat in diff
+            if stat.size_diff and stat.traceback[0].filename not in _IGNORED_FILES
+        }
+
+    def _merged_stats(self, record: _StageRecord) -> Optional[pstats.Stats]:
+        """合并各线程的 CPU 分析数据"""
+        stats = None
+        for profile in record.profiles.values():
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # 未采集到任何调用
+                continue
+        return stats
+
+    def get_hotspots(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        汇总热点
+
+        Returns:
+            {'stages': 按耗时排序的阶段, 'functions': 按自身耗时排序的函数,
+             'allocations': 按净分配排序的代码行}
+        """
+        stages = sorted(
+            ({'stage': r.stage, 'site': r.site, 'calls': r.calls,
+              'wall_time': r.wall_time, 'alloc_bytes': r.alloc_bytes,
+              'alloc_skipped': r.alloc_skipped}
+             for r in self.records.values()),
+            key=lambda item: -item['wall_time'])
+
+        self._collect_allocations()
+        functions = {}
+        for record in self.records.values():
+            stats = self._merged_stats(record)
+            if stats is not None:
+                for func, (_, ncalls, tottime, _, _) in stats.stats.items():
+                    label = _func_label(func)
+                    entry = functions.setdefault(label, {'function': label, 'calls': 0,
+                                                         'self_time': 0.0})
+                    entry['calls'] += ncalls
+                    entry['self_time'] += tottime
+
+        return {
+            'stages': stages[:self.top_n],
+            'functions': sorted(functions.values(),
+                                key=lambda item: -item['self_time'])[:self.top_n],
+            'allocations': [{'line': line, 'bytes': size} for line, size in
+                            sorted(self.alloc_lines.items(), key=lambda item: -item[1])[:self.top_n]]
+        }
+
+    def reset(self):
+        """清空已采集的数据"""
+        with self._lock:
+            self.records = {}
+            self.alloc_lines = {}
+
+
+class _NullContext:
+    """未开启分析时使用的空上下文"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _StageContext:
+    """
+    阶段分析上下文
+
+    嵌套阶段进入时暂停外层阶段的 CPU 分析，因此各阶段的 CPU 数据不含子阶段；
+    CPU 数据为线程CPU时间，阶段耗时为包含子阶段与等待的墙钟时间；
+    内存分配为包含子阶段的净分配字节数。tracemalloc 统计的是整个进程，
+    与其他线程的阶段并发执行时无法区分归属，这些调用不计入内存分配
+    """
+
+    def __init__(self, owner: StageProfiler, stage: str, site: Optional[str]):
+        self.owner = owner
+        self.stage = stage
+        self.site = site
+
+    def __enter__(self):
+        stack = self.owner._stack()
+        if self.site is None:
+            self.site = stack[-1].site if stack else '-'
+        self.record = self.owner._record(self.stage, self.site)
+
+        # 暂停外层阶段
+        self.parent_profile = stack[-1].profile if stack else None
+        if self.parent_profile is not None:
+            self.parent_profile.disable()
+
+        self.overlapped = False
+        self.traced_start = None
+        if self.owner.trace_memory:
+            if not stack:
+                self._register_root()
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+
+        thread_id = threading.get_ident()
+        self.profile = self.record.profiles.get(thread_id)
+        if self.profile is None:
+            # 按线程CPU时间计时：流水线各线程等待 GIL/IO/队列的时间不计入函数耗时
+            self.profile = self.record.profiles[thread_id] = cProfile.Profile(time.thread_time)
+        try:
+            self.profile.enable()
+        except ValueError:
+            # 其他分析工具已在运行（如 Python 3.12+ 的多线程场景），仅记录耗时
+            self.profile = None
+
+        stack.append(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start_time
+        if self.profile is not None:
+            self.profile.disable()
+
+        stack = self.owner._stack()
+        stack.pop()
+
+        if self.traced_start is not None:
+            root = stack[0] if stack else self
+            with self.owner._lock:
+                if root.overlapped:
+                    self.record.alloc_skipped += 1
+                elif tracemalloc.is_tracing():
+                    self.record.alloc_bytes += \
+                        tracemalloc.get_traced_memory()[0] - self.traced_start
+                if not stack:
+                    self.owner._active_roots.pop(threading.get_ident(), None)
+
+        with self.owner._lock:
+            self.record.calls += 1
+            self.record.wall_time += elapsed
+
+        # 恢复外层阶段
+        if self.parent_profile is not None:
+            try:
+                self.parent_profile.enable()
+            except ValueError:
+                pass
+        return False
+
+
+    def _register_root(self):
+        """登记本线程最外层阶段；已有其他线程的阶段在运行时双方都标记为并发"""
+        with self.owner._lock:
+            active = self.owner._active_roots
+            for other in active.values():
+                other.overlapped = True
+                self.overlapped = True
+            active[threading.get_ident()] = self
+
+
+_IGNORED_FILES = {tracemalloc.__file__, __file__}
+
+
+def _func_label(func) -> str:
+    """pstats 函数键转换为可读名称"""
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return f"{os.path.basename(filename)}:{lineno}({name})"
+
+
+def _collapsed_stacks(stats: pstats.Stats, max_depth: int = 64,
+                      min_weight: float = 1e-5) -> List[str]:
+    """
+    由 pstats 调用关系生成折叠栈（单位：微秒）
+
+    cProfile 只记录调用边，子函数耗时按各调用方占比分摊到调用路径上；
+    分摊后累计耗时低于 min_weight 秒的路径不再展开，避免路径数量爆炸
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [func for func, (_, _, _, _, callers) in entries.items()
+             if not any(caller in entries for caller in callers)]
+
+    folded = {}
+
+    def walk(func, path, scale):
+        _, _, tottime, cumtime, _ = entries[func]
+        path = path + [_func_label(func)]
+        weight = int(tottime * scale * 1e6)
+        if weight > 0:
+            key = ';'.join(path)
+            folded[key] = folded.get(key, 0) + weight
+        if len(path) >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, []):
+            callee_time = entries[callee][3]
+            if callee_time <= 0 or _func_label(callee) in path:
+                continue
+            callee_scale = scale * min(1.0, edge_time / callee_time)
+            if callee_time * callee_scale < min_weight:
+                continue
+            walk(callee, path, callee_scale)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return [f"{stack} {weight}" for stack, weight in folded.items()]
+
+
+def _safe_name(name: str) -> str:
+    """生成可用作文件名的字符串"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name)
+
+
+def profiled(stage: str, site_arg: Optional[str] = None):
+    """
+    阶段分析装饰器
+
+    Args:
+        stage: 阶段名称
+        site_arg: 作为网站名称的参数名；为空时沿用外层阶段的网站
+    """
+    def decorator(func):
+        site_index = None
+        if site_arg:
+            site_index = list(inspect.signature(func).parameters).index(site_arg)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            site = None
+            if site_arg:
+                site = kwargs.get(site_arg, args[site_index] if len(args) > site_index else None)
+            with profiler.stage(stage, site):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 创建全局分析器实例
+profiler = StageProfiler()
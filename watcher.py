@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+watcher.py - 数据目录监听模块
+监听 data/<来源>/<NN 表名>/ 目录，新增或修改的xlsx文件写入完成后立即入库
+只处理已配置来源下报表目录中的文件，data 下的其他文件（导出结果、分析报告等）一律忽略
+Linux 下使用 inotify，其他平台或 inotify 不可用时退化为定时轮询
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from data_processor import DataStreamProcessor
+from cleaning_rules import report_type_from_path
+from pipeline import StagedPipeline
+
+
+# inotify 事件常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _is_workbook(path: str) -> bool:
+    """是否为需要处理的xlsx文件（忽略Office临时文件和隐藏文件）"""
+    name = os.path.basename(path)
+    return name.lower().endswith('.xlsx') and not name.startswith(('~$', '.'))
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """文件签名（大小, 修改时间），文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _scan_workbooks(root: str) -> List[str]:
+    """列出目录下全部xlsx文件"""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, name) for name in filenames
+                     if _is_workbook(name))
+    return paths
+
+
+class _InotifyBackend:
+    """inotify 监听后端（递归监听全部子目录）"""
+
+    def __init__(self, root: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}
+        for dirpath, _, _ in os.walk(root):
+            self._add_watch(dirpath)
+
+    def _add_watch(self, path: str):
+        """添加目录监听"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def poll(self, timeout: float) -> Optional[List[str]]:
+        """
+        等待文件事件
+
+        Returns:
+            发生变化的文件路径；事件队列溢出时返回 None（需要全量扫描）
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # 新建/移入的目录：补充监听并收集其中已有的文件
+                for dirpath, _, _ in os.walk(path):
+                    self._add_watch(dirpath)
+                paths.extend(_scan_workbooks(path))
+            elif _is_workbook(path):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        """关闭 inotify 文件描述符"""
+        os.close(self.fd)
+
+
+class _PollingBackend:
+    """轮询监听后端"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.signatures = {path: _file_signature(path) for path in _scan_workbooks(root)}
+
+    def poll(self, timeout: float) -> List[str]:
+        """间隔 timeout 秒扫描一次，返回签名变化的文件"""
+        time.sleep(timeout)
+        changed = []
+        current = {}
+        for path in _scan_workbooks(self.root):
+            current[path] = _file_signature(path)
+            if self.signatures.get(path) != current[path]:
+                changed.append(path)
+        self.signatures = current
+        return changed
+
+    def close(self):
+        """无需释放资源"""
+        pass
+
+
+class DataFolderWatcher:
+    """数据目录监听器（常驻进程，使用同一个数据库连接）"""
+
+    def __init__(self, config: Dict[str, Any], processor: Optional[DataStreamProcessor] = None):
+        """
+        初始化监听器
+
+        Args:
+            config: 配置字典（data_root, source_websites, debounce_seconds, pipeline 等）
+            processor: 数据处理器，默认按 config 创建
+        """
+        self.config = config
+        self.data_root = str(Path(config.get('data_root', 'data')).resolve())
+        self.source_websites = config.get('source_websites', {})
+        self.debounce_seconds = config.get('debounce_seconds', 2.0)
+        self.poll_interval = config.get('poll_interval', 1.0)
+
+        self.processor = processor or DataStreamProcessor(config)
+        self._init_state_table()
+
+        # 同时就绪的多个文件（如启动时补录）走分阶段流水线
+        self.pipeline = StagedPipeline(self.processor, config.get('pipeline'))
+
+        # 待处理文件 {路径: (签名, 签名最近变化时间)}
+        self.pending = {}
+
+        # 监听统计
+        self.stats = {
+            'files_detected': 0,
+            'files_ingested': 0,
+            'files_failed': 0
+        }
+
+        self.backend = self._create_backend(config.get('watch_backend', 'auto'))
+
+    def _init_state_table(self):
+        """记录已入库文件的签名，重启后只处理新增或修改的文件"""
+        conn = self.processor.conn
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS watch_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+    def _create_backend(self, backend: str):
+        """选择监听后端：auto 时 Linux 优先 inotify"""
+        if backend in ('auto', 'inotify') and sys.platform.startswith('linux'):
+            try:
+                return _InotifyBackend(self.data_root)
+            except (OSError, AttributeError) as e:
+                print(f"⚠️  inotify 不可用，使用轮询模式: {str(e)[:50]}")
+        return _PollingBackend(self.data_root)
+
+    def scan_existing(self):
+        """启动时扫描：签名与上次入库不一致的文件加入待处理队列"""
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.processor.conn.execute('SELECT path, size, mtime_ns FROM watch_files')}
+        for path in _scan_workbooks(self.data_root):
+            if known.get(self._relative(path)) != _file_signature(path):
+                self._mark_pending(path)
+
+    def run(self, stop_after: Optional[float] = None):
+        """
+        持续监听（Ctrl+C 结束）
+
+        Args:
+            stop_after: 运行指定秒数后退出（为空时一直运行）
+        """
+        print(f"👀 开始监听数据目录: {self.data_root} ({type(self.backend).__name__})")
+        deadline = time.time() + stop_after if stop_after else None
+        self.scan_existing()
+
+        while deadline is None or time.time() < deadline:
+            # 有待处理文件时缩短等待时间，以便及时完成去抖
+            timeout = min(self.poll_interval, self.debounce_seconds / 2) \
+                if self.pending else self.poll_interval
+            changed = self.backend.poll(timeout)
+            if changed is None:
+                changed = _scan_workbooks(self.data_root)
+            for path in changed:
+                self._mark_pending(path)
+            self._ingest_ready()
+
+    def accepts(self, path: str) -> bool:
+        """是否为 <来源>/<NN 表名>/*.xlsx 形式且来源已配置的数据文件"""
+        if not _is_workbook(path):
+            return False
+        parts = Path(self._relative(path)).parts
+        return len(parts) == 3 and parts[0] in self.source_websites and \
+            report_type_from_path(path) is not None
+
+    def _mark_pending(self, path: str):
+        """记录文件变化（不符合目录约定的文件直接忽略）"""
+        if not self.accepts(path):
+            return
+        if path not in self.pending:
+            self.stats['files_detected'] += 1
+        self.pending[path] = (_file_signature(path), time.time())
+
+    def _ingest_ready(self):
+        """去抖：签名在 debounce_seconds 内保持不变的文件视为写入完成并入库"""
+        now = time.time()
+        ready = []
+        for path, (signature, changed_at) in list(self.pending.items()):
+            current = _file_signature(path)
+            if current is None:
+                # 文件已被删除或移走
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now)
+            elif now - changed_at >= self.debounce_seconds:
+                del self.pending[path]
+                ready.append((path, current))
+
+        if len(ready) > 1:
+            self.ingest_batch(ready)
+        elif ready:
+            self.ingest_file(*ready[0])
+
+    def ingest_file(self, path: str, signature: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        将单个文件送入数据处理器
+
+        Args:
+            path: 文件路径
+            signature: 文件签名（用于记录入库状态）
+
+        Returns:
+            是否成功
+        """
+        if not self.accepts(path):
+            print(f"   ⚠️  不是已配置来源的报表文件，跳过: {self._relative(path)}")
+            return False
+        job = self._make_job(path)
+        print(f"\n📥 检测到数据文件: {job['job_id']}")
+        success = self.processor.process_website_data_stream(
+            job['website_name'], job['response_data'], job['extraction_result'], job['config'])
+        self._record_result(path, signature, success)
+        return success
+
+    def ingest_batch(self, files: List[Tuple[str, Tuple[int, int]]]) -> Dict[str, bool]:
+        """
+        通过分阶段流水线批量入库
+
+        Args:
+            files: [(文件路径, 文件签名)]
+
+        Returns:
+            {相对路径: 是否成功}
+        """
+        files = [(path, signature) for path, signature in files if self.accepts(path)]
+        jobs = [self._make_job(path) for path, _ in files]
+        print(f"\n📥 检测到 {len(jobs)} 个数据文件，批量入库...")
+        results = self.pipeline.run(jobs)
+        for path, signature in files:
+            self._record_result(path, signature, results.get(self._relative(path), False))
+
+        # 各阶段指标：阻塞时间与队列深度反映背压所在的阶段
+        for stage, metrics in self.pipeline.get_metrics().items():
+            print(f"   ⚙️  {stage}: 完成 {metrics['processed']} 失败 {metrics['failed']}，"
+                  f"处理 {metrics['busy_time']:.1f} 秒，阻塞 {metrics['blocked_time']:.1f} 秒，"
+                  f"队列 最大 {metrics['max_queue_depth']} / 平均 {metrics['avg_queue_depth']:.1f}"
+                  f"（容量 {metrics['queue_size']}）")
+        return results
+
+    def _make_job(self, path: str) -> Dict[str, Any]:
+        """生成数据处理任务（与流水线任务格式一致）"""
+        relative = self._relative(path)
+        website_name = self.source_websites[Path(relative).parts[0]]
+
+        config = dict(self.config)
+        config['local_cache_path'] = path
+        return {
+            'job_id': relative,
+            'website_name': website_name,
+            'response_data': {'content_type': 'excel', 'from_cache': True},
+            'extraction_result': {'dataset': relative},
+            'config': config
+        }
+
+    def _record_result(self, path: str, signature: Optional[Tuple[int, int]], success: bool):
+        """记录入库结果（成功的文件写入 watch_files，重启后不再重复处理）"""
+        if success:
+            signature = signature or _file_signature(path)
+            self.processor.conn.execute('''
+                INSERT OR REPLACE INTO watch_files (path, size, mtime_ns, ingested_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (self._relative(path), signature[0], signature[1]))
+            self.processor.conn.commit()
+            self.stats['files_ingested'] += 1
+        else:
+            self.stats['files_failed'] += 1
+
+    def _relative(self, path: str) -> str:
+        """相对 data_root 的路径（统一使用 / 分隔）"""
+        return Path(os.path.relpath(path, self.data_root)).as_posix()
+
+    def close(self):
+        """释放监听资源并关闭数据库连接"""
+        self.backend.close()
+        self.processor.close()
+
+
+def run_watch(config: Optional[Dict[str, Any]] = None):
+    """
+    启动监听模式（简化接口）
+    """
+    if config is None:
+        import config_secret
+        config = config_secret.get_watch_config()
+
+    watcher = DataFolderWatcher(config)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("\n⏹️  监听已停止")
+    finally:
+        stats = watcher.stats
+        print(f"📊 发现 {stats['files_detected']} 个文件，入库 {stats['files_ingested']} 个，"
+              f"失败 {stats['files_failed']} 个")
+        watcher.close()